@@ -1,13 +1,27 @@
 """Bot class."""
-import time
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
+from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from cachetools import TTLCache
 from loguru import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
-from telegram.ext import CallbackContext, CallbackQueryHandler, CommandHandler, Defaults, Updater
+from telegram.error import BadRequest
+from telegram.ext import (
+    CallbackContext,
+    CallbackQueryHandler,
+    CommandHandler,
+    Defaults,
+    Filters,
+    MessageHandler,
+    Updater,
+)
 from web3 import Web3
 
 from pancaketrade.conversations import (
@@ -26,6 +40,28 @@ from pancaketrade.utils.db import get_token_watchers, init_db
 from pancaketrade.utils.generic import chat_message, check_chat_id, format_token_amount, get_tokens_keyboard_layout
 from pancaketrade.watchers import OrderWatcher, TokenWatcher
 
+DEC_ONE = Decimal(1)
+DEC_HUNDRED = Decimal(100)
+
+APPROVE_PATTERN = re.compile(r'^approve:0x[a-fA-F0-9]{40}$')
+ADDRESS_PATTERN = re.compile(r'^address:0x[a-fA-F0-9]{40}$')
+MENU_PATTERN = re.compile(r'^(?:addorder|removeorder|buysell|sellall|approve|address)$')
+# commands that ask to pick a token, see TradeBot.prompts_select_token
+SELECT_TOKEN_PATTERN = re.compile(r'^/(?:sellall|addorder|removeorder|buysell|approve|address|edittoken|removetoken)\b')
+
+SUMMARY_JOB_ID = 'summary'
+
+TOKEN_STATUS_TEMPLATE = (
+    '<b>{name}</b>: {balance}\n'
+    '<b>Links</b>: {chart_links}\n'
+    '<b>Value</b>: <code>{balance_bnb:.4f}</code> RUSDBUSD\n'
+    '<b>Price</b>: <code>{price:.3g}</code> RUSD-BUSD/Token\n'
+    '{effective_buy_price}'
+    '<b>Orders</b>: (underlined = tracking trailing stop loss)\n'
+    '{orders}'
+)
+TOKEN_EMPTY_STATUS_TEMPLATE = '<b>{name}</b>: 0 (no orders)\n<b>Links</b>: {chart_links}'
+
 
 class TradeBot:
     """Bot class."""
@@ -42,8 +78,18 @@ class TradeBot:
         )
         defaults = Defaults(parse_mode=ParseMode.HTML, disable_web_page_preview=True, timeout=120)
         # persistence = PicklePersistence(filename='botpersistence')
-        self.updater = Updater(token=config.secrets.telegram_token, persistence=None, defaults=defaults)
+        self.updater = Updater(
+            token=config.secrets.telegram_token,
+            persistence=None,
+            defaults=defaults,
+            # the status messages are edited concurrently, they should not wait for a free connection
+            request_kwargs={'con_pool_size': 32, 'read_timeout': 30, 'connect_timeout': 10},
+        )
         self.dispatcher = self.updater.dispatcher
+        # short-lived caches for the RPC results displayed in the status messages
+        self.price_cache: TTLCache = TTLCache(maxsize=256, ttl=15)
+        self.cache_lock = threading.Lock()
+        self.global_markup = InlineKeyboardMarkup(self.get_global_keyboard())  # the buttons never change
         self.convos = {
             'addtoken': AddTokenConversation(parent=self, config=self.config),
             'edittoken': EditTokenConversation(parent=self, config=self.config),
@@ -57,15 +103,26 @@ class TradeBot:
         self.watchers: Dict[str, TokenWatcher] = get_token_watchers(
             net=self.net, dispatcher=self.dispatcher, config=self.config
         )
+        self.sorted_tokens_cache: Optional[Tuple[TokenWatcher, ...]] = None
+        self.tokens_markup_cache: Dict[str, InlineKeyboardMarkup] = {}
+        self.orders_by_id: Dict[int, OrderWatcher] = {}
+        for token in self.watchers.values():
+            for order in token.orders:
+                self.register_order(order)
+        # the status messages need several RPC calls per token, we fetch them concurrently
+        self.status_executor = ThreadPoolExecutor(max_workers=min(16, max(4, len(self.watchers))))
         self.status_scheduler = BackgroundScheduler(
+            executors={'default': SchedulerThreadPoolExecutor(8)},
             job_defaults={
                 'coalesce': True,
                 'max_instances': 1,
                 'misfire_grace_time': 20,
-            }
+            },
         )
+        self.status_in_progress = False
         self.start_status_update()
         self.last_status_message_id: Optional[int] = None
+        self.last_summary_text: Optional[str] = None
         self.prompts_select_token = {
             'sellall': 'Sell full blance now for which token?',
             'addorder': 'Add order to which token?',
@@ -80,22 +137,11 @@ class TradeBot:
     def setup_telegram(self):
         self.dispatcher.add_handler(CommandHandler('start', self.command_start))
         self.dispatcher.add_handler(CommandHandler('status', self.command_status))
-        self.dispatcher.add_handler(CommandHandler('sellall', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('addorder', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('removeorder', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('buysell', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('approve', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('address', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('edittoken', self.command_show_all_tokens))
-        self.dispatcher.add_handler(CommandHandler('removetoken', self.command_show_all_tokens))
+        self.dispatcher.add_handler(MessageHandler(Filters.regex(SELECT_TOKEN_PATTERN), self.command_show_all_tokens))
         self.dispatcher.add_handler(CommandHandler('order', self.command_order))
-        self.dispatcher.add_handler(CallbackQueryHandler(self.command_approve, pattern='^approve:0x[a-fA-F0-9]{40}$'))
-        self.dispatcher.add_handler(CallbackQueryHandler(self.command_address, pattern='^address:0x[a-fA-F0-9]{40}$'))
-        self.dispatcher.add_handler(
-            CallbackQueryHandler(
-                self.command_show_all_tokens, pattern='^addorder$|^removeorder$|^buysell$|^sellall$|^approve$|^address$'
-            )
-        )
+        self.dispatcher.add_handler(CallbackQueryHandler(self.command_approve, pattern=APPROVE_PATTERN))
+        self.dispatcher.add_handler(CallbackQueryHandler(self.command_address, pattern=ADDRESS_PATTERN))
+        self.dispatcher.add_handler(CallbackQueryHandler(self.command_show_all_tokens, pattern=MENU_PATTERN))
         self.dispatcher.add_handler(CallbackQueryHandler(self.cancel_command, pattern='^canceltokenchoice$'))
         for convo in self.convos.values():
             self.dispatcher.add_handler(convo.handler)
@@ -119,13 +165,30 @@ class TradeBot:
     def start_status_update(self):
         if not self.config.update_messages:
             return
-        trigger = IntervalTrigger(seconds=30)
-        self.status_scheduler.add_job(self.update_status, trigger=trigger)
+        trigger = IntervalTrigger(seconds=self.config.status_update_interval)
+        self.status_scheduler.add_job(self.update_summary_message, trigger=trigger, id=SUMMARY_JOB_ID)
+        self.schedule_token_status_updates()
         self.status_scheduler.start()
 
+    def schedule_token_status_updates(self):
+        """Add one status update job per token, with start times spread over the update interval."""
+        if not self.config.update_messages:
+            return
+        for job in self.status_scheduler.get_jobs():
+            if job.id != SUMMARY_JOB_ID:
+                job.remove()
+        interval = self.config.status_update_interval
+        sorted_tokens = self.sorted_tokens
+        now = datetime.now()
+        for i, token in enumerate(sorted_tokens):
+            trigger = IntervalTrigger(
+                seconds=interval, start_date=now + timedelta(seconds=interval * (i + 1) / len(sorted_tokens))
+            )
+            self.status_scheduler.add_job(self.update_token_status, trigger=trigger, args=[token], id=token.address)
+
     def start(self):
         try:
-            self.dispatcher.bot.send_message(chat_id=self.config.secrets.admin_chat_id, text='🤖 Bot started')
+            self.dispatcher.bot.send_message(chat_id=self.config.admin_chat_id, text='🤖 Bot started')
         except Exception:  # chat doesn't exist yet, do nothing
             logger.info('Chat with user doesn\'t exist yet.')
         logger.info('Bot started')
@@ -144,28 +207,33 @@ class TradeBot:
 
     @check_chat_id
     def command_status(self, update: Update, context: CallbackContext):
-        self.pause_status_update(True)  # prevent running an update while we are changing the last message id
-        sorted_tokens = sorted(self.watchers.values(), key=lambda token: token.symbol.lower())
-        balances: List[Decimal] = []
-        for token in sorted_tokens:
-            status, balance_bnb = self.get_token_status(token)
-            balances.append(balance_bnb)
-            msg = chat_message(update, context, text=status, edit=False)
-            if msg is not None:
-                self.watchers[token.address].last_status_message_id = msg.message_id
-        message, buttons = self.get_summary_message(balances)
-        reply_markup = InlineKeyboardMarkup(buttons)
-        stat_msg = chat_message(
-            update,
-            context,
-            text=message,
-            reply_markup=reply_markup,
-            edit=False,
-        )
-        if stat_msg is not None:
-            self.last_status_message_id = stat_msg.message_id
-        time.sleep(1)  # make sure the message go received by the telegram API
-        self.pause_status_update(False)  # resume update job
+        self.status_in_progress = True  # prevent running an update while we are changing the last message id
+        try:
+            sorted_tokens = self.sorted_tokens
+            balances: List[Decimal] = []
+            # map keeps the order of the tokens, so the messages are sent in alphabetical order
+            for token, (status, balance_bnb) in zip(
+                sorted_tokens, self.status_executor.map(self.get_token_status, sorted_tokens)
+            ):
+                balances.append(balance_bnb)
+                token.last_balance_bnb = balance_bnb
+                msg = chat_message(update, context, text=status, edit=False)
+                if msg is not None:
+                    token.last_status_message_id = msg.message_id
+                    token.last_status_text = status
+            message, reply_markup = self.get_summary_message(balances)
+            stat_msg = chat_message(
+                update,
+                context,
+                text=message,
+                reply_markup=reply_markup,
+                edit=False,
+            )
+            if stat_msg is not None:
+                self.last_status_message_id = stat_msg.message_id
+                self.last_summary_text = message
+        finally:
+            self.status_in_progress = False
 
     @check_chat_id
     def command_order(self, update: Update, context: CallbackContext):
@@ -178,12 +246,7 @@ class TradeBot:
         except Exception:
             chat_message(update, context, text=error_msg, edit=False)
             return
-        order: Optional[OrderWatcher] = None
-        for token in self.watchers.values():
-            for o in token.orders:
-                if o.order_record.id != order_id:
-                    continue
-                order = o
+        order = self.orders_by_id.get(order_id)
         if not order:
             chat_message(update, context, text='⛔️ Could not find order with this ID.', edit=False)
             return
@@ -216,6 +279,7 @@ class TradeBot:
             edit=self.config.update_messages,
         )
         approved = token.approve(v2=v2)
+        self.clear_status_cache()
         if approved:
             chat_message(
                 update,
@@ -255,7 +319,7 @@ class TradeBot:
             except KeyError:
                 chat_message(update, context, text='⛔️ Invalid command.', edit=False)
                 return
-            buttons_layout = get_tokens_keyboard_layout(self.watchers, callback_prefix=command)
+            reply_markup = self.get_tokens_markup(command)
         else:  # callback query from button
             assert update.callback_query
             query = update.callback_query
@@ -265,8 +329,7 @@ class TradeBot:
             except KeyError:
                 chat_message(update, context, text='⛔️ Invalid command.', edit=False)
                 return
-            buttons_layout = get_tokens_keyboard_layout(self.watchers, callback_prefix=query.data)
-        reply_markup = InlineKeyboardMarkup(buttons_layout)
+            reply_markup = self.get_tokens_markup(query.data)
         chat_message(
             update,
             context,
@@ -281,102 +344,126 @@ class TradeBot:
         query = update.callback_query
         query.delete_message()
 
-    def update_status(self):
+    def update_token_status(self, token: TokenWatcher):
+        if token.last_status_message_id is None:
+            return  # we probably did not call status since start
+        if self.status_in_progress:
+            return  # the /status command is sending new messages
+        status, token.last_balance_bnb = self.get_token_status(token)
+        if status == token.last_status_text:
+            return  # nothing changed, no need to call the telegram API
+        try:
+            self.dispatcher.bot.edit_message_text(
+                status,
+                chat_id=self.config.admin_chat_id,
+                message_id=token.last_status_message_id,
+            )
+            token.last_status_text = status
+        except BadRequest as e:
+            if not e.message.startswith('Message is not modified'):
+                self.report_edit_failure(e)
+        except Exception as e:
+            self.report_edit_failure(e)
+
+    def update_summary_message(self):
         if self.last_status_message_id is None:
             return  # we probably did not call status since start
-        sorted_tokens = sorted(self.watchers.values(), key=lambda token: token.symbol.lower())
-        balances: List[Decimal] = []
-        for token in sorted_tokens:
-            if token.last_status_message_id is None:
-                continue
-            status, balance_bnb = self.get_token_status(token)
-            balances.append(balance_bnb)
-            try:
-                self.dispatcher.bot.edit_message_text(
-                    status,
-                    chat_id=self.config.secrets.admin_chat_id,
-                    message_id=token.last_status_message_id,
-                )
-            except Exception as e:  # for example message content was not changed
-                if not str(e).startswith('Message is not modified'):
-                    logger.error(f'Exception during message update: {e}')
-                    self.dispatcher.bot.send_message(
-                        chat_id=self.config.secrets.admin_chat_id, text=f'Exception during message update: {e}'
-                    )
-        message, buttons = self.get_summary_message(balances)
-        reply_markup = InlineKeyboardMarkup(buttons)
+        if self.status_in_progress:
+            return  # the /status command is sending new messages
+        # the token values are refreshed by the token jobs
+        message, reply_markup = self.get_summary_message([token.last_balance_bnb for token in self.sorted_tokens])
+        if message == self.last_summary_text:
+            return
         try:
             self.dispatcher.bot.edit_message_text(
                 message,
-                chat_id=self.config.secrets.admin_chat_id,
+                chat_id=self.config.admin_chat_id,
                 message_id=self.last_status_message_id,
                 reply_markup=reply_markup,
             )
-        except Exception as e:  # for example message content was not changed
-            if not str(e).startswith('Message is not modified'):
-                logger.error(f'Exception during message update: {e}')
-                self.dispatcher.bot.send_message(
-                    chat_id=self.config.secrets.admin_chat_id, text=f'Exception during message update: {e}'
-                )
+            self.last_summary_text = message
+        except BadRequest as e:
+            if not e.message.startswith('Message is not modified'):
+                self.report_edit_failure(e)
+        except Exception as e:
+            self.report_edit_failure(e)
+
+    def report_edit_failure(self, e: Exception):
+        msg = f'Exception during message update: {e}'
+        logger.error(msg)
+        self.dispatcher.bot.send_message(chat_id=self.config.admin_chat_id, text=msg)
 
     def get_token_status(self, token: TokenWatcher) -> Tuple[str, Decimal]:
-        token_price, lp_v2 = self.net.get_token_price(
-            token_address=token.address, token_decimals=token.decimals, sell=True
-        )
-        chart_links = [
-            f'<a href="https://poocoin.app/tokens/{token.address}">Poocoin</a>',
-            f'<a href="https://charts.bogged.finance/?token={token.address}">Bogged</a>',
-            f'<a href="https://dex.guru/token/{token.address}-bsc">Dex.Guru</a>',
-        ]
-        token_lp = self.net.find_lp_address(token_address=token.address, v2=lp_v2)
-        if token_lp:
-            chart_links.append(f'<a href="https://www.dextools.io/app/pancakeswap/pair-explorer/{token_lp}">Dext</a>')
-        chart_links.append(f'<a href="https://bscscan.com/token/{token.address}?a={self.net.wallet}">BscScan</a>')
-        token_price_usd = self.net.get_token_price_usd(
-            token_address=token.address, token_decimals=token.decimals, sell=True, token_price=token_price
+        if token.was_empty and not token.orders:
+            # sold out and nothing to monitor, only check the balance until we hold the token again
+            token_balance = self.net.get_token_balance(token_address=token.address)
+            if not token_balance:
+                message = TOKEN_EMPTY_STATUS_TEMPLATE.format(
+                    name=token.name,
+                    chart_links=self.get_chart_links(
+                        token, self.net.find_lp_address(token_address=token.address, v2=True)
+                    ),
+                )
+                return message, Decimal(0)
+        token_price, lp_v2, token_balance = self.get_cached(
+            self.price_cache,
+            key=token.address,
+            func=lambda: self.net.get_token_price_and_balance(
+                token_address=token.address, token_decimals=token.decimals, sell=True
+            ),
         )
-        token_balance = self.net.get_token_balance(token_address=token.address)
+        token.was_empty = not token_balance
+        chart_links = self.get_chart_links(token, self.net.find_lp_address(token_address=token.address, v2=lp_v2))
         token_balance_bnb = self.net.get_token_balance_bnb(
             token_address=token.address, balance=token_balance, token_price=token_price
         )
-        token_balance_usd = self.net.get_token_balance_usd(token_address=token.address, balance_bnb=token_balance_bnb)
         effective_buy_price = ''
         if token.effective_buy_price:
-            price_diff_percent = ((token_price / token.effective_buy_price) - Decimal(1)) * Decimal(100)
+            price_diff_percent = ((token_price / token.effective_buy_price) - DEC_ONE) * DEC_HUNDRED
             diff_icon = '🆙' if price_diff_percent >= 0 else '🔽'
             effective_buy_price = (
                 f'<b>At buy (after tax)</b>: <code>{token.effective_buy_price:.4f}</code> RUSDBUSD/Token '
                 + f'(now {price_diff_percent:+.1f}% {diff_icon})\n'
             )
         orders_sorted = sorted(
-            token.orders, key=lambda o: o.limit_price if o.limit_price else Decimal(1e12), reverse=True
-        )  # if no limit price (market price) display first (big artificial value)
+            token.orders, key=lambda o: (not o.limit_price, o.limit_price or 0), reverse=True
+        )  # if no limit price (market price) display first
         orders = [str(order) for order in orders_sorted]
-        message = (
-            f'<b>{token.name}</b>: {format_token_amount(token_balance)}\n'
-            + f'<b>Links</b>: {"    ".join(chart_links)}\n'
-            + f'<b>Value</b>: <code>{token_balance_bnb:.4f}</code> RUSDBUSD\n'
-            + f'<b>Price</b>: <code>{token_price:.3g}</code> RUSD-BUSD/Token\n'
-            + effective_buy_price
-            + '<b>Orders</b>: (underlined = tracking trailing stop loss)\n'
-            + '\n'.join(orders)
+        message = TOKEN_STATUS_TEMPLATE.format(
+            name=token.name,
+            balance=format_token_amount(token_balance),
+            chart_links=chart_links,
+            balance_bnb=token_balance_bnb,
+            price=token_price,
+            effective_buy_price=effective_buy_price,
+            orders='\n'.join(orders),
         )
         return message, token_balance_bnb
 
-    def get_summary_message(self, token_balances: List[Decimal]) -> Tuple[str, List[List[InlineKeyboardButton]]]:
+    def get_chart_links(self, token: TokenWatcher, token_lp: Optional[str]) -> str:
+        dext_link = (
+            f'    <a href="https://www.dextools.io/app/pancakeswap/pair-explorer/{token_lp}">Dext</a>'
+            if token_lp
+            else ''
+        )
+        return f'{token.chart_links_prefix}{dext_link}    {token.chart_links_suffix}'
+
+    def get_summary_message(self, token_balances: List[Decimal]) -> Tuple[str, InlineKeyboardMarkup]:
         balance_bnb = self.net.get_bnb_balance()
         price_bnb = self.net.get_bnb_price()
         total_positions = sum(token_balances)
         grand_total = balance_bnb + total_positions
-        msg = (
-            f'<b>BUSD balance</b>: <code>{balance_bnb:.4f}</code> BUSD (${balance_bnb * price_bnb:.2f})\n'
-            + f'<b>Tokens balance</b>: <code>{total_positions:.4f}</code> BUSD (${total_positions * price_bnb:.2f})\n'
-            + f'<b>Total</b>: <code>{grand_total:.4f}</code> BUSD (${grand_total * price_bnb:.2f}) '
-            + f'<a href="https://bscscan.com/address/{self.net.wallet}">BscScan</a>\n'
-            + f'<b>BUSD price</b>: ${price_bnb:.2f}\n'
-            + 'Which action do you want to perform next?'
+        msg = '\n'.join(
+            [
+                f'<b>BUSD balance</b>: <code>{balance_bnb:.4f}</code> BUSD (${balance_bnb * price_bnb:.2f})',
+                f'<b>Tokens balance</b>: <code>{total_positions:.4f}</code> BUSD (${total_positions * price_bnb:.2f})',
+                f'<b>Total</b>: <code>{grand_total:.4f}</code> BUSD (${grand_total * price_bnb:.2f}) '
+                f'<a href="https://bscscan.com/address/{self.net.wallet}">BscScan</a>',
+                f'<b>BUSD price</b>: ${price_bnb:.2f}',
+                'Which action do you want to perform next?',
+            ]
         )
-        return msg, self.get_global_keyboard()
+        return msg, self.global_markup
 
     def get_global_keyboard(self) -> List[List[InlineKeyboardButton]]:
         buttons = [
@@ -394,15 +481,51 @@ class TradeBot:
         ]
         return buttons
 
+    @property
+    def sorted_tokens(self) -> Tuple[TokenWatcher, ...]:
+        if self.sorted_tokens_cache is None:
+            self.sorted_tokens_cache = tuple(sorted(self.watchers.values(), key=lambda token: token.symbol_lower))
+        return self.sorted_tokens_cache
+
+    def get_tokens_markup(self, callback_prefix: str) -> InlineKeyboardMarkup:
+        try:
+            return self.tokens_markup_cache[callback_prefix]
+        except KeyError:
+            pass
+        reply_markup = InlineKeyboardMarkup(get_tokens_keyboard_layout(self.watchers, callback_prefix=callback_prefix))
+        self.tokens_markup_cache[callback_prefix] = reply_markup
+        return reply_markup
+
+    def on_watchers_changed(self):
+        """Invalidate what is derived from the watchers, call this after adding, removing or renaming a token."""
+        self.sorted_tokens_cache = None
+        self.tokens_markup_cache = {}
+        self.schedule_token_status_updates()
+
+    def register_order(self, order: OrderWatcher):
+        self.orders_by_id[order.order_record.id] = order
+        order.on_trade = self.clear_status_cache  # the cached balances are outdated after a fill
+        order.on_finish = self.unregister_order
+
+    def unregister_order(self, order: OrderWatcher):
+        self.orders_by_id.pop(order.order_record.id, None)
+
+    def get_cached(self, cache: TTLCache, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self.cache_lock:
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+        value = func()  # don't hold the lock during the RPC call
+        with self.cache_lock:
+            cache[key] = value
+        return value
+
+    def clear_status_cache(self):
+        with self.cache_lock:
+            self.price_cache.clear()
+
     def error_handler(self, update: Update, context: CallbackContext) -> None:
         logger.error('Exception while handling an update')
         logger.error(context.error)
         chat_message(update, context, text=f'⛔️ Exception while handling an update\n{context.error}', edit=False)
-
-    def pause_status_update(self, pause: bool = True):
-        for job in self.status_scheduler.get_jobs():
-            # prevent running an update while we are changing the last message id
-            if pause:
-                job.pause()
-            else:
-                job.resume()
@@ -5,8 +5,16 @@ from typing import Mapping, NamedTuple
 from pancaketrade.network import Network
 from pancaketrade.persistence import Order, db
 from pancaketrade.utils.config import Config
-from pancaketrade.utils.generic import chat_message, check_chat_id, format_price_fixed, format_token_amount
+from pancaketrade.utils.generic import (
+    GWEI,
+    chat_message,
+    check_chat_id,
+    format_gas_price,
+    format_price_fixed,
+    format_token_amount,
+)
 from pancaketrade.watchers import OrderWatcher, TokenWatcher
+from pancaketrade.watchers.order import TYPE_NAMES
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     CallbackContext,
@@ -382,7 +390,7 @@ class AddOrderConversation:
             chat_message(update, context, text='⚠️ The slippage must be between 0.01 and 100, try again:', edit=False)
             return self.next.SLIPPAGE
         order['slippage'] = f'{slippage_percent:.2f}'
-        network_gas_price = Decimal(self.net.w3.eth.gas_price) / Decimal(10 ** 9)
+        network_gas_price = Decimal(self.net.w3.eth.gas_price) / GWEI
         chat_message(
             update,
             context,
@@ -472,13 +480,6 @@ class AddOrderConversation:
         trailing = (
             f'Trailing stop loss {order["trailing_stop"]}% callback\n' if order["trailing_stop"] is not None else ''
         )
-        gas_price = (
-            f'{Decimal(order["gas_price"]) / Decimal(10 ** 9):.1f} Gwei'
-            if order["gas_price"] and not order["gas_price"].startswith('+')
-            else 'network default'
-            if order["gas_price"] is None
-            else f'network default {order["gas_price"]} Gwei'
-        )
         limit_price = Decimal(order["limit_price"])
         bnb_price = self.net.get_bnb_price()
         usd_amount = bnb_price * amount if order['type'] == 'buy' else bnb_price * limit_price * amount
@@ -489,7 +490,7 @@ class AddOrderConversation:
             + f'Amount: {format_token_amount(amount)} {unit} (${usd_amount:.2f})\n'
             + f'Price {comparision} {limit_price:.3g} BNB per token\n'
             + f'Slippage: {order["slippage"]}%\n'
-            + f'Gas: {gas_price}'
+            + f'Gas: {format_gas_price(order["gas_price"])}'
         )
         chat_message(
             update,
@@ -518,7 +519,7 @@ class AddOrderConversation:
         token: TokenWatcher = self.parent.watchers[add['token_address']]
         del add['token_address']  # not needed in order record creation
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 order_record = Order.create(token=token.token_record, created=datetime.now(), **add)
         except Exception as e:
@@ -531,6 +532,7 @@ class AddOrderConversation:
             order_record=order_record, net=self.net, dispatcher=context.dispatcher, chat_id=update.effective_chat.id
         )
         token.orders.append(order)
+        self.parent.register_order(order)
         chat_message(
             update,
             context,
@@ -547,15 +549,7 @@ class AddOrderConversation:
         return ConversationHandler.END
 
     def get_type_name(self, order: Mapping) -> str:
-        return (
-            'limit buy'
-            if order['type'] == 'buy' and not order['above']
-            else 'stop loss'
-            if order['type'] == 'sell' and not order['above']
-            else 'limit sell'
-            if order['type'] == 'sell' and order['above']
-            else 'unknown'
-        )
+        return TYPE_NAMES.get((order['type'], bool(order['above'])), 'unknown')
 
     def get_comparison_symbol(self, order: Mapping) -> str:
         return '&gt;' if order['above'] else '&lt;'
@@ -161,7 +161,7 @@ class AddTokenConversation:
             edit=False,
         )
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 token_record = Token.create(**add)
         except Exception as e:
@@ -173,6 +173,7 @@ class AddTokenConversation:
             db.close()
         token = TokenWatcher(token_record=token_record, net=self.net, dispatcher=context.dispatcher, config=self.config)
         self.parent.watchers[token.address] = token
+        self.parent.on_watchers_changed()
         balance = self.net.get_token_balance(token_address=token.address)
         balance_usd = self.net.get_token_balance_usd(token_address=token.address, balance=balance)
         buttons = [
@@ -307,7 +307,7 @@ class BuySellConversation:
         add['gas_price'] = '+10.1'
         del add['token_address']  # not needed in order record creation
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 order_record = Order.create(token=token.token_record, created=datetime.now(), **add)
         except Exception as e:
@@ -320,6 +320,7 @@ class BuySellConversation:
             order_record=order_record, net=self.net, dispatcher=context.dispatcher, chat_id=update.effective_chat.id
         )
         token.orders.append(order)
+        self.parent.register_order(order)
         chat_message(
             update,
             context,
@@ -172,7 +172,7 @@ class EditTokenConversation:
 
         token_record = token.token_record
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 token_record.icon = edit['icon']
                 token_record.save()
@@ -184,6 +184,7 @@ class EditTokenConversation:
             db.close()
         token.emoji = token_record.icon + ' ' if token_record.icon else ''
         token.name = token.emoji + token.symbol
+        self.parent.on_watchers_changed()  # the token buttons show the new name
         chat_message(
             update,
             context,
@@ -234,7 +235,7 @@ class EditTokenConversation:
 
         token_record = token.token_record
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 token_record.default_slippage = edit['default_slippage']
                 token_record.save()
@@ -309,7 +310,7 @@ class EditTokenConversation:
 
         token_record = token.token_record
         try:
-            db.connect()
+            db.connect(reuse_if_open=True)
             with db.atomic():
                 token_record.effective_buy_price = (
                     str(edit['effective_buy_price']) if edit['effective_buy_price'] else None
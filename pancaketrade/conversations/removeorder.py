@@ -1,4 +1,3 @@
-from decimal import Decimal
 from typing import List, NamedTuple
 
 from pancaketrade.network import Network
@@ -44,7 +43,7 @@ class RemoveOrderConversation:
         token: TokenWatcher = self.parent.watchers[token_address]
         context.user_data['removeorder'] = {'token_address': token_address}
         orders = token.orders
-        orders_sorted = sorted(orders, key=lambda o: o.limit_price if o.limit_price else Decimal(1e12), reverse=True)
+        orders_sorted = sorted(orders, key=lambda o: (not o.limit_price, o.limit_price or 0), reverse=True)
         orders_display = [str(order) for order in orders_sorted]
         buttons: List[InlineKeyboardButton] = [
             InlineKeyboardButton(
@@ -112,6 +111,7 @@ class RemoveOrderConversation:
             return ConversationHandler.END
         remove_order(order_record=order.order_record)
         token.orders.remove(order)
+        self.parent.unregister_order(order)
         chat_message(
             update,
             context,
@@ -126,10 +126,10 @@ class RemoveOrderConversation:
         return ConversationHandler.END
 
     def get_type_name(self, order: OrderWatcher) -> str:
-        return order.get_type_name()
+        return order.type_name
 
     def get_type_icon(self, order: OrderWatcher) -> str:
-        return order.get_type_icon()
+        return order.type_icon
 
     def cancel_command(self, update: Update, context: CallbackContext):
         assert context.user_data is not None
@@ -67,11 +67,14 @@ class RemoveTokenConversation:
             return ConversationHandler.END
         token = self.parent.watchers[query.data]
         token.stop_monitoring()
+        for order in token.orders:
+            self.parent.unregister_order(order)
         token_name = token.name
         if token.last_status_message_id is not None:
             context.bot.delete_message(chat_id=update.effective_chat.id, message_id=token.last_status_message_id)
         remove_token(self.parent.watchers[query.data].token_record)
         del self.parent.watchers[query.data]
+        self.parent.on_watchers_changed()
         chat_message(
             update,
             context,
@@ -4,7 +4,7 @@ from typing import NamedTuple
 from loguru import logger
 from pancaketrade.network import Network
 from pancaketrade.utils.config import Config
-from pancaketrade.utils.generic import chat_message, check_chat_id, format_token_amount
+from pancaketrade.utils.generic import bscscan_tx_link, chat_message, check_chat_id, format_token_amount
 from pancaketrade.watchers import TokenWatcher
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CallbackContext, CallbackQueryHandler, CommandHandler, ConversationHandler
@@ -92,30 +92,33 @@ class SellAllConversation:
             text=f'Selling {format_token_amount(balance_decimal)} {token.symbol}...',
             edit=self.config.update_messages,
         )
-        res, bnb_out, txhash_or_error = self.net.sell_tokens(
+        result = self.net.sell_tokens(
             token.address,
             amount_tokens=balance_tokens,
             slippage_percent=token.default_slippage,
             gas_price='+20.1',
             v2=v2,
         )
-        if not res:
-            logger.error(f'Transaction failed: {txhash_or_error}')
-            if len(txhash_or_error) == 66:
-                reason_or_link = f'<a href="https://bscscan.com/tx/{txhash_or_error}">{txhash_or_error[:8]}...</a>'
+        if not result.success:
+            logger.error(f'Transaction failed: {result.txhash or result.error}')
+            if result.txhash is not None:
+                reason_or_link = bscscan_tx_link(result.txhash)
             else:
-                reason_or_link = txhash_or_error
+                reason_or_link = str(result.error)
             chat_message(
                 update, context, text=f'⛔️ Transaction failed: {reason_or_link}', edit=self.config.update_messages
             )
             return ConversationHandler.END
+        assert result.txhash is not None
+        bnb_out = result.amount
         logger.success(f'Sell transaction succeeded. Received {bnb_out:.3g} BNB')
+        self.parent.clear_status_cache()
         usd_out = self.net.get_bnb_price() * bnb_out
         chat_message(
             update,
             context,
             text=f'✅ Got {bnb_out:.3g} BNB (${usd_out:.2f}) at '
-            + f'tx <a href="https://bscscan.com/tx/{txhash_or_error}">{txhash_or_error[:8]}...</a>',
+            + f'tx {bscscan_tx_link(result.txhash)}',
             edit=self.config.update_messages,
         )
         if len(token.orders) > 0:
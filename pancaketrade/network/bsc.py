@@ -1,7 +1,8 @@
+import threading
 import time
 from decimal import Decimal
 from pathlib import Path
-from typing import Dict, NamedTuple, Optional, Set, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
 
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -14,7 +15,7 @@ from web3 import Web3
 from web3.contract import Contract, ContractFunction
 from web3.exceptions import ABIFunctionNotFound, ContractLogicError
 from web3.middleware import geth_poa_middleware
-from web3.types import BlockIdentifier, ChecksumAddress, HexBytes, Nonce, TxParams, TxReceipt, Wei
+from web3.types import ChecksumAddress, HexBytes, Nonce, TxParams, TxReceipt, Wei
 
 GAS_LIMIT_FAILSAFE = Wei(2000000)  # if the estimated limit is above this one, don't use the estimated price
 
@@ -29,6 +30,13 @@ class NetworkAddresses(NamedTuple):
     router_v2: ChecksumAddress = Web3.toChecksumAddress('0x10ED43C718714eb63d5aA57B78B54704E256024E')
 
 
+class TradeResult(NamedTuple):
+    success: bool
+    amount: Decimal  # tokens received when buying, BNB received when selling
+    txhash: Optional[str] = None  # hex string, None if the transaction was not sent
+    error: Optional[str] = None
+
+
 class NetworkContracts:
     wbnb: Contract
     busd: Contract
@@ -62,12 +70,17 @@ class Network:
         session = requests.Session()
         session.mount('http://', adapter)
         session.mount('https://', adapter)
-        auth = (
-            {'auth': HTTPBasicAuth(secrets.rpc_auth_user, secrets.rpc_auth_password)}
+        self.rpc_auth: Optional[HTTPBasicAuth] = (
+            HTTPBasicAuth(secrets.rpc_auth_user, secrets.rpc_auth_password)
             if secrets.rpc_auth_user and secrets.rpc_auth_password
             else None
         )
-        w3_provider = Web3.HTTPProvider(endpoint_uri=rpc, session=session, request_kwargs=auth)
+        self.rpc = rpc
+        self.session = session  # also used directly for batched calls
+        self.batch_supported = True  # set to False once the RPC rejects a batch request
+        w3_provider = Web3.HTTPProvider(
+            endpoint_uri=rpc, session=session, request_kwargs={'auth': self.rpc_auth} if self.rpc_auth else None
+        )
         self.w3 = Web3(provider=w3_provider)
         self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
         self.addr = NetworkAddresses()
@@ -128,7 +141,7 @@ class Network:
             return Decimal(0)
         return balance
 
-    @cached(cache=TTLCache(maxsize=256, ttl=0.5))
+    @cached(cache=TTLCache(maxsize=256, ttl=0.5), lock=threading.Lock())
     def get_token_balance_wei(self, token_address: ChecksumAddress) -> Wei:
         token_contract = self.get_token_contract(token_address)
         try:
@@ -149,7 +162,7 @@ class Network:
         usd_per_bnb = self.get_bnb_price()
         return token_price * usd_per_bnb
 
-    @cached(cache=TTLCache(maxsize=256, ttl=1))
+    @cached(cache=TTLCache(maxsize=256, ttl=1), lock=threading.Lock())
     def get_token_price(
         self, token_address: ChecksumAddress, token_decimals: Optional[int] = None, sell: bool = True
     ) -> Tuple[Decimal, bool]:
@@ -158,44 +171,73 @@ class Network:
         if token_decimals is None:
             token_decimals = self.get_token_decimals(token_address=token_address)
         token_contract = self.get_token_contract(token_address)
-        lp_v1 = self.find_lp_address(token_address=token_address, v2=False)
-        lp_v2 = self.find_lp_address(token_address=token_address, v2=True)
-        if lp_v1 is None and lp_v2 is None:  # no lp
-            return Decimal(0), True
-        elif lp_v2 is None and lp_v1:  # only v1
-            return (
-                self.get_token_price_by_lp(
-                    token_contract=token_contract, token_lp=lp_v1, token_decimals=token_decimals, ignore_poolsize=True
-                ),
-                False,
-            )
-        elif lp_v1 is None and lp_v2:  # only v2
-            return (
-                self.get_token_price_by_lp(
-                    token_contract=token_contract, token_lp=lp_v2, token_decimals=token_decimals, ignore_poolsize=True
-                ),
-                True,
+        reserves: Dict[bool, Tuple[Decimal, Decimal]] = {}
+        for v2 in [False, True]:
+            lp = self.find_lp_address(token_address=token_address, v2=v2)
+            if lp is None:
+                continue
+            lp_bnb_amount = Decimal(self.contracts.wbnb.functions.balanceOf(lp).call())
+            lp_token_amount = Decimal(token_contract.functions.balanceOf(lp).call())
+            reserves[v2] = (lp_bnb_amount, lp_token_amount * Decimal(10 ** (18 - token_decimals)))
+        return self.select_token_price(reserves=reserves, sell=sell)
+
+    def get_token_price_and_balance(
+        self, token_address: ChecksumAddress, token_decimals: int, sell: bool = True
+    ) -> Tuple[Decimal, bool, Decimal]:
+        """Get the token price, whether it's from the v2 LP, and the wallet balance in a single RPC request."""
+        token_contract = self.get_token_contract(token_address)
+        is_wbnb = token_address == self.addr.wbnb  # special case for wbnb, no need for the LPs
+        lps = {
+            v2: None if is_wbnb else self.find_lp_address(token_address=token_address, v2=v2) for v2 in [False, True]
+        }
+        lp_versions = [v2 for v2, lp in lps.items() if lp is not None]
+        calls: List[Tuple[Contract, str, Tuple[Any, ...]]] = [(token_contract, 'balanceOf', (self.wallet,))]
+        for v2 in lp_versions:
+            calls.append((self.contracts.wbnb, 'balanceOf', (lps[v2],)))
+            calls.append((token_contract, 'balanceOf', (lps[v2],)))
+        results: Optional[List[Any]] = None
+        if self.batch_supported:
+            try:
+                results = self.batch_call(calls)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:  # try again next time
+                logger.warning(f'Batch request failed, falling back to single requests: {e}')
+            except Exception as e:  # some RPC providers don't support batch requests
+                logger.warning(f'Batch requests not supported by the RPC, using single requests from now on: {e}')
+                self.batch_supported = False
+        if results is None:
+            token_price, v2 = self.get_token_price(
+                token_address=token_address, token_decimals=token_decimals, sell=sell
             )
+            return token_price, v2, self.get_token_balance(token_address=token_address)
+        balance = Decimal(results[0]) / Decimal(10 ** token_decimals)
+        if is_wbnb:
+            return Decimal(1), True, balance
+        reserves = {
+            v2: (Decimal(results[2 * i + 1]), Decimal(results[2 * i + 2]) * Decimal(10 ** (18 - token_decimals)))
+            for i, v2 in enumerate(lp_versions)
+        }
+        token_price, v2 = self.select_token_price(reserves=reserves, sell=sell)
+        return token_price, v2, balance
+
+    def select_token_price(
+        self, reserves: Dict[bool, Tuple[Decimal, Decimal]], sell: bool = True
+    ) -> Tuple[Decimal, bool]:
+        """Choose the best price between the v1 (False) and v2 (True) LPs.
+
+        The reserves contain the amount of BNB and the amount of tokens (normalized to 18 decimals) in each LP.
+        """
+        if not reserves:  # no lp
+            return Decimal(0), True
+        elif len(reserves) == 1:  # only one version
+            v2, (lp_bnb_amount, lp_token_amount) = next(iter(reserves.items()))
+            return self.get_price_from_reserves(lp_bnb_amount, lp_token_amount, ignore_poolsize=True), v2
         # both exist
-        assert lp_v1 and lp_v2
-        price_v1 = self.get_token_price_by_lp(
-            token_contract=token_contract, token_lp=lp_v1, token_decimals=token_decimals
-        )
-        price_v2 = self.get_token_price_by_lp(
-            token_contract=token_contract, token_lp=lp_v2, token_decimals=token_decimals
-        )
+        price_v1 = self.get_price_from_reserves(*reserves[False])
+        price_v2 = self.get_price_from_reserves(*reserves[True])
         # if the BNB in pool or tokens in pool is zero, we get a price of zero. Also if LP is too empty
         if price_v1 == 0 and price_v2 == 0:  # both lp's are too small, we choose the largest
-            biggest_lp, v2 = self.get_biggest_lp(lp1=lp_v1, lp2=lp_v2)
-            return (
-                self.get_token_price_by_lp(
-                    token_contract=token_contract,
-                    token_lp=biggest_lp,
-                    token_decimals=token_decimals,
-                    ignore_poolsize=True,
-                ),
-                v2,
-            )
+            v2 = reserves[True][0] >= reserves[False][0]
+            return self.get_price_from_reserves(*reserves[v2], ignore_poolsize=True), v2
         elif price_v1 == 0:
             return price_v2, True
         elif price_v2 == 0:
@@ -205,30 +247,45 @@ class Network:
             return max(price_v1, price_v2), price_v2 > price_v1
         return min(price_v1, price_v2), price_v2 < price_v1
 
-    def get_token_price_by_lp(
-        self,
-        token_contract: Contract,
-        token_lp: ChecksumAddress,
-        token_decimals: int,
-        ignore_poolsize: bool = False,
-        block_identifier: BlockIdentifier = 'latest',
+    def get_price_from_reserves(
+        self, lp_bnb_amount: Decimal, lp_token_amount: Decimal, ignore_poolsize: bool = False
     ) -> Decimal:
-        lp_bnb_amount = Decimal(
-            self.contracts.wbnb.functions.balanceOf(token_lp).call(block_identifier=block_identifier)
-        )
         if lp_bnb_amount / Decimal(10 ** 18) < self.min_pool_size_bnb and not ignore_poolsize:  # not enough liquidity
             return Decimal(0)
-        lp_token_amount = Decimal(
-            token_contract.functions.balanceOf(token_lp).call(block_identifier=block_identifier)
-        ) * Decimal(10 ** (18 - token_decimals))
-        # normalize to 18 decimals
         try:
             bnb_per_token = lp_bnb_amount / lp_token_amount
         except Exception:
             bnb_per_token = Decimal(0)
         return bnb_per_token
 
-    @cached(cache=TTLCache(maxsize=1, ttl=30))
+    def batch_call(self, calls: Sequence[Tuple[Contract, str, Tuple[Any, ...]]]) -> List[Any]:
+        """Execute several read-only contract calls in a single JSON-RPC batch request.
+
+        Each call is a tuple of the contract, the function name and the function arguments.
+        """
+        payload = [
+            {
+                'jsonrpc': '2.0',
+                'method': 'eth_call',
+                'params': [{'to': contract.address, 'data': contract.encodeABI(fn_name=fn_name, args=args)}, 'latest'],
+                'id': i,
+            }
+            for i, (contract, fn_name, args) in enumerate(calls)
+        ]
+        response = self.session.post(self.rpc, json=payload, timeout=10, auth=self.rpc_auth)
+        response.raise_for_status()
+        responses = {res['id']: res for res in response.json()}
+        results: List[Any] = []
+        for i, (contract, fn_name, _) in enumerate(calls):
+            if 'error' in responses[i]:
+                raise ValueError(responses[i]['error'])
+            # only simple output types are supported (no tuples), which is enough for balanceOf
+            output_types = [output['type'] for output in contract.get_function_by_name(fn_name).abi['outputs']]
+            decoded = self.w3.codec.decode_abi(output_types, HexBytes(responses[i]['result']))
+            results.append(decoded[0] if len(decoded) == 1 else decoded)
+        return results
+
+    @cached(cache=TTLCache(maxsize=1, ttl=30), lock=threading.Lock())
     def get_bnb_price(self) -> Decimal:
         lp = self.find_lp_address(token_address=self.addr.busd, v2=True)
         if not lp:
@@ -237,26 +294,19 @@ class Network:
         busd_amount = Decimal(self.contracts.busd.functions.balanceOf(lp).call())
         return busd_amount / bnb_amount
 
-    @cached(cache=LRUCache(maxsize=256))
+    @cached(cache=LRUCache(maxsize=256), lock=threading.Lock())
     def get_token_decimals(self, token_address: ChecksumAddress) -> int:
         token_contract = self.get_token_contract(token_address=token_address)
         decimals = token_contract.functions.decimals().call()
         return int(decimals)
 
-    @cached(cache=LRUCache(maxsize=256))
+    @cached(cache=LRUCache(maxsize=256), lock=threading.Lock())
     def get_token_symbol(self, token_address: ChecksumAddress) -> str:
         token_contract = self.get_token_contract(token_address=token_address)
         symbol = token_contract.functions.symbol().call()
         return symbol
 
-    def get_biggest_lp(self, lp1: ChecksumAddress, lp2: ChecksumAddress) -> Tuple[ChecksumAddress, bool]:
-        bnb_amount1 = Decimal(self.contracts.wbnb.functions.balanceOf(lp1).call())
-        bnb_amount2 = Decimal(self.contracts.wbnb.functions.balanceOf(lp2).call())
-        if bnb_amount1 > bnb_amount2:
-            return lp1, False
-        return lp2, True
-
-    @cached(cache=LRUCache(maxsize=256))
+    @cached(cache=LRUCache(maxsize=256), lock=threading.Lock())
     def get_token_contract(self, token_address: ChecksumAddress) -> Contract:
         with Path('pancaketrade/abi/bep20.abi').open('r') as f:
             abi = f.read()
@@ -324,7 +374,7 @@ class Network:
         slippage_percent: Decimal,
         gas_price: Optional[str],
         v2: bool = True,
-    ) -> Tuple[bool, Decimal, str]:
+    ) -> TradeResult:
         balance_bnb = self.w3.eth.get_balance(self.wallet)
         balance_busd = self.contracts.wbnb.functions.balanceOf(self.wallet).call()
         logger.error(balance_busd)
@@ -350,15 +400,15 @@ class Network:
         )
         if receipt is None:
             logger.error('Can\'t get gas estimate')
-            return (
-                False,
-                Decimal(0),
-                f'Can\'t get gas estimate, check if slippage is set correctly (currently {slippage_percent}%)',
+            return TradeResult(
+                success=False,
+                amount=Decimal(0),
+                error=f'Can\'t get gas estimate, check if slippage is set correctly (currently {slippage_percent}%)',
             )
         txhash = Web3.toHex(primitive=receipt["transactionHash"])
         if receipt['status'] == 0:  # fail
             logger.error(f'Buy transaction failed at tx {txhash}')
-            return False, Decimal(0), txhash
+            return TradeResult(success=False, amount=Decimal(0), txhash=txhash, error='Transaction reverted')
         amount_out = Decimal(0)
         logs = self.get_token_contract(token_address=token_address).events.Transfer().processReceipt(receipt)
         for log in reversed(logs):  # only get last withdrawal call
@@ -369,7 +419,7 @@ class Network:
             amount_out = Decimal(log['args']['value']) / Decimal(10 ** self.get_token_decimals(token_address))
             break
         logger.success(f'Buy transaction succeeded at tx {txhash}')
-        return True, amount_out, txhash
+        return TradeResult(success=True, amount=amount_out, txhash=txhash)
 
     def buy_tokens_with_params(
         self,
@@ -407,7 +457,7 @@ class Network:
         slippage_percent: Decimal,
         gas_price: Optional[str],
         v2: bool = True,
-    ) -> Tuple[bool, Decimal, str]:
+    ) -> TradeResult:
         balance_tokens = self.get_token_balance_wei(token_address=token_address)
         amount_tokens = min(amount_tokens, balance_tokens)  # partially fill order if possible
         slippage_ratio = (Decimal(100) - slippage_percent) / Decimal(100)
@@ -431,15 +481,15 @@ class Network:
         )
         if receipt is None:
             logger.error('Can\'t get gas estimate')
-            return (
-                False,
-                Decimal(0),
-                f'Can\'t get gas estimate, check if slippage is set correctly (currently {slippage_percent}%)',
+            return TradeResult(
+                success=False,
+                amount=Decimal(0),
+                error=f'Can\'t get gas estimate, check if slippage is set correctly (currently {slippage_percent}%)',
             )
         txhash = Web3.toHex(primitive=receipt["transactionHash"])
         if receipt['status'] == 0:  # fail
             logger.error(f'Sell transaction failed at tx {txhash}')
-            return False, Decimal(0), txhash
+            return TradeResult(success=False, amount=Decimal(0), txhash=txhash, error='Transaction reverted')
         amount_out = Decimal(0)
         logs = self.contracts.wbnb.events.Withdrawal().processReceipt(receipt)
         for log in reversed(logs):  # only get last withdrawal call
@@ -450,7 +500,7 @@ class Network:
             amount_out = Decimal(Web3.fromWei(log['args']['wad'], unit='ether'))
             break
         logger.success(f'Sell transaction succeeded at tx {txhash}')
-        return True, amount_out, txhash
+        return TradeResult(success=True, amount=amount_out, txhash=txhash)
 
     def sell_tokens_with_params(
         self,
@@ -37,8 +37,10 @@ class Config:
     min_pool_size_bnb: float = 25
     monitor_interval: float = 5
     update_messages: bool = False
+    status_update_interval: float = 60
     config_file: str = 'config.yml'
     _pk: str = field(repr=False, default='')
+    admin_chat_id: int = field(init=False, default=0)  # copy of secrets.admin_chat_id, checked for every update
 
     def __post_init__(self):
         self.wallet = Web3.toChecksumAddress(self.wallet)
@@ -49,6 +51,7 @@ class Config:
             if key in ['telegram_token', 'admin_chat_id', 'rpc_auth_user', 'rpc_auth_password']
         }
         self.secrets = ConfigSecrets(**secrets, _pk=self._pk)
+        self.admin_chat_id = int(self.secrets.admin_chat_id)
 
 
 class PrivateKeyValidator(Validator):
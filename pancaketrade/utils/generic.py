@@ -1,7 +1,7 @@
 """Generic utilities."""
 import functools
 import logging
-import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from decimal import Decimal
 from typing import Any, Callable, Iterable, List, Mapping, Optional
 
@@ -9,6 +9,10 @@ from loguru import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
 from telegram.ext import CallbackContext
 
+GWEI = Decimal(10 ** 9)
+
+thread_pool = ThreadPoolExecutor(max_workers=8)  # bounds the number of trades running at the same time
+
 
 class InterceptHandler(logging.Handler):
     def emit(self, record):
@@ -28,9 +32,14 @@ class InterceptHandler(logging.Handler):
 
 
 def start_in_thread(func: Callable, args: Iterable[Any] = []) -> None:
-    t = threading.Thread(target=func, args=args)
-    t.daemon = True
-    t.start()
+    future = thread_pool.submit(func, *args)
+    future.add_done_callback(log_thread_exception)
+
+
+def log_thread_exception(future: Future) -> None:
+    exception = future.exception()
+    if exception is not None:
+        logger.opt(exception=exception).error(f'Exception in thread: {exception}')
 
 
 def check_chat_id(func: Callable) -> Callable:
@@ -53,11 +62,11 @@ def check_chat_id(func: Callable) -> Callable:
             logger.debug('No text in message')
             return
         chat_id = update.effective_chat.id
-        if chat_id == this.config.secrets.admin_chat_id:
+        if chat_id == this.config.admin_chat_id:
             return func(this, update, context, *args, **kwargs)
         logger.warning(f'Prevented user {chat_id} to interact.')
         context.bot.send_message(
-            chat_id=this.config.secrets.admin_chat_id, text=f'Prevented user {chat_id} to interact.'
+            chat_id=this.config.admin_chat_id, text=f'Prevented user {chat_id} to interact.'
         )
         context.bot.send_message(chat_id=chat_id, text='This bot is not public, you are not allowed to use it.')
 
@@ -105,6 +114,19 @@ def format_token_amount(amount: Decimal) -> str:
     return f'{amount:.4g}'
 
 
+def bscscan_tx_link(txhash: str) -> str:
+    return f'<a href="https://bscscan.com/tx/{txhash}">{txhash[:8]}...</a>'
+
+
+def format_gas_price(gas_price: Optional[str]) -> str:
+    """Format the gas price of an order, stored in wei or as an offset in Gwei from the network gas price."""
+    if gas_price is None:
+        return 'network default'
+    if not gas_price or gas_price.startswith('+'):
+        return f'network default {gas_price} Gwei'
+    return f'{Decimal(gas_price) / GWEI:.1f} Gwei'
+
+
 def format_price_fixed(price: Decimal) -> str:
     price_fixed = f'{price:.{-price.adjusted()+2}f}' if price < 100 else f'{price:.1f}'
     return price_fixed
@@ -0,0 +1,42 @@
+"""Queue for Telegram notifications."""
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+from telegram import Bot
+from telegram.error import RetryAfter
+
+message_queue: 'queue.Queue[Tuple[Bot, int, Dict[str, Any]]]' = queue.Queue()
+worker: Optional[threading.Thread] = None
+worker_lock = threading.Lock()
+
+
+def send(bot: Bot, chat_id: int, **kwargs) -> None:
+    """Queue a message, messages are sent in order by a single worker thread."""
+    start_worker()
+    message_queue.put((bot, chat_id, kwargs))
+
+
+def start_worker() -> None:
+    global worker
+    with worker_lock:
+        if worker is None:
+            worker = threading.Thread(target=process_queue, daemon=True)
+            worker.start()
+
+
+def process_queue() -> None:
+    while True:
+        bot, chat_id, kwargs = message_queue.get()
+        while True:
+            try:
+                bot.send_message(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:  # rate limited, wait and send the same message again to keep the order
+                logger.warning(f'Telegram rate limit reached, retrying in {e.retry_after}s')
+                time.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.error(f'Exception while sending message: {e}')
+            break
@@ -29,6 +29,7 @@ class TokenWatcher:
         self.address = Web3.toChecksumAddress(token_record.address)
         self.decimals = int(token_record.decimals)
         self.symbol = str(token_record.symbol)
+        self.symbol_lower = self.symbol.lower()  # for sorting
         self.emoji = token_record.icon + ' ' if token_record.icon else ''
         self.name = self.emoji + self.symbol
         self.default_slippage = Decimal(token_record.default_slippage)
@@ -40,7 +41,7 @@ class TokenWatcher:
                 order_record=order_record,
                 net=self.net,
                 dispatcher=self.dispatcher,
-                chat_id=self.config.secrets.admin_chat_id,
+                chat_id=self.config.admin_chat_id,
             )
             for order_record in orders
         ]
@@ -49,6 +50,18 @@ class TokenWatcher:
             job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': max(1, int(0.8 * self.interval))}
         )
         self.last_status_message_id: Optional[int] = None
+        self.last_status_text: Optional[str] = None
+        self.was_empty = False  # no balance at the last status update
+        self.last_balance_bnb = Decimal(0)
+        # the chart links only depend on the token and wallet addresses, except Dext which needs the LP address
+        self.chart_links_prefix = '    '.join(
+            [
+                f'<a href="https://poocoin.app/tokens/{self.address}">Poocoin</a>',
+                f'<a href="https://charts.bogged.finance/?token={self.address}">Bogged</a>',
+                f'<a href="https://dex.guru/token/{self.address}-bsc">Dex.Guru</a>',
+            ]
+        )
+        self.chart_links_suffix = f'<a href="https://bscscan.com/token/{self.address}?a={self.net.wallet}">BscScan</a>'
         self.start_monitoring()
 
     def start_monitoring(self):
@@ -61,45 +74,47 @@ class TokenWatcher:
 
     def monitor_price(self):
         self.update_effective_buy_price()
+        self.orders = [order for order in self.orders if not order.finished]
         if not self.orders:
             return
+        has_buy_orders = any(order.type == 'buy' for order in self.orders)
+        has_sell_orders = any(order.type == 'sell' for order in self.orders)
         sell_price, sell_v2 = self.net.get_token_price(
             token_address=self.address, token_decimals=self.decimals, sell=True
         )
-        if self.net.has_both_versions(token_address=self.address):
+        # the buy price is only needed by buy orders
+        if has_buy_orders and self.net.has_both_versions(token_address=self.address):
             buy_price, buy_v2 = self.net.get_token_price(
                 token_address=self.address, token_decimals=self.decimals, sell=False
             )
         else:
             buy_price = sell_price
             buy_v2 = sell_v2
-        indices_to_remove: List[int] = []
-        for i, order in enumerate(self.orders):
-            if order.finished:
-                indices_to_remove.append(i)
-                continue
-            v2 = buy_v2 if order.type == 'buy' else sell_v2
-            if not self.net.is_approved(token_address=self.address, v2=v2) and order.type == 'sell':
-                # when selling we require that the token is approved on pcs beforehand
-                version = 'v2' if v2 else 'v1'
-                logger.info(f'Need to approve {self.symbol} for trading on PancakeSwap {version}.')
-                self.dispatcher.bot.send_message(
-                    chat_id=self.config.secrets.admin_chat_id,
-                    text=f'Approving {self.symbol} for trading on PancakeSwap {version}...',
-                )
-                res = self.net.approve(token_address=self.address, v2=v2)
-                if res:
-                    self.dispatcher.bot.send_message(
-                        chat_id=self.config.secrets.admin_chat_id,
-                        text='✅ Approval successful!',
-                    )
-                else:
-                    self.dispatcher.bot.send_message(
-                        chat_id=self.config.secrets.admin_chat_id,
-                        text='⛔ Approval failed',
-                    )
-            order.price_update(sell_price=sell_price, buy_price=buy_price, sell_v2=sell_v2, buy_v2=buy_v2)
-        self.orders = [o for i, o in enumerate(self.orders) if i not in indices_to_remove]
+        if has_sell_orders and not self.net.is_approved(token_address=self.address, v2=sell_v2):
+            # when selling we require that the token is approved on pcs beforehand
+            self.approve_for_selling(v2=sell_v2)
+        sell_price_f, buy_price_f = float(sell_price), float(buy_price)  # the orders compare prices as floats
+        for order in self.orders:
+            order.price_update(sell_price=sell_price_f, buy_price=buy_price_f, sell_v2=sell_v2, buy_v2=buy_v2)
+
+    def approve_for_selling(self, v2: bool):
+        version = 'v2' if v2 else 'v1'
+        logger.info(f'Need to approve {self.symbol} for trading on PancakeSwap {version}.')
+        self.dispatcher.bot.send_message(
+            chat_id=self.config.admin_chat_id,
+            text=f'Approving {self.symbol} for trading on PancakeSwap {version}...',
+        )
+        res = self.net.approve(token_address=self.address, v2=v2)
+        if res:
+            self.dispatcher.bot.send_message(
+                chat_id=self.config.admin_chat_id,
+                text='✅ Approval successful!',
+            )
+        else:
+            self.dispatcher.bot.send_message(
+                chat_id=self.config.admin_chat_id,
+                text='⛔ Approval failed',
+            )
 
     def update_effective_buy_price(self):
         self.effective_buy_price = (